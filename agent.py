@@ -1,4 +1,3 @@
-import subprocess
 import json
 import platform
 import shutil
@@ -8,53 +7,69 @@ import os
 from typing import List, Optional
 from dotenv import load_dotenv
 from groq import Groq
+from process_stats import run_measured
+from rate_limiter import call_with_retry, estimate_tokens, get_limiter
 
 load_dotenv()
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-client = Groq(api_key=GROQ_API_KEY)
+client = Groq(api_key=GROQ_API_KEY, max_retries=0)
+MAX_COMPLETION_TOKENS = 1024
 conversation_history = []
 
 def query_llm(prompt: str) -> str:
     global conversation_history
-    try:
-        # Append system and user messages
-        conversation_history.append({"role": "system","content": "You are agent who converts requests to valid shell commands based on the OS running."})
-        conversation_history.append({"role": "user", "content": prompt})
+    # Append system and user messages
+    conversation_history.append({"role": "system","content": "You are agent who converts requests to valid shell commands based on the OS running."})
+    conversation_history.append({"role": "user", "content": prompt})
 
-        completion = client.chat.completions.create(
+    estimated = estimate_tokens(conversation_history, MAX_COMPLETION_TOKENS)
+    completion = call_with_retry(
+        lambda: client.chat.completions.create(
             model="llama-3.1-8b-instant",
             messages=conversation_history,
             temperature=1,
-            max_completion_tokens=1024,
+            max_completion_tokens=MAX_COMPLETION_TOKENS,
             top_p=1,
             stream=False,
             stop=None
-        )
-        llm_output = completion.choices[0].message.content or ""
-        conversation_history.append({"role": "assistant", "content": llm_output})
-        if len(conversation_history) > 40:
-            conversation_history = conversation_history[-40:]
-        return llm_output
-    except Exception as e:
-        return f"LLM error: {str(e)}"
+        ),
+        get_limiter(),
+        estimated,
+        max_retries=int(os.getenv("GROQ_MAX_RETRIES", "5")),
+    )
+    get_limiter().record_usage(estimated, getattr(getattr(completion, "usage", None), "total_tokens", None))
+    llm_output = completion.choices[0].message.content or ""
+    conversation_history.append({"role": "assistant", "content": llm_output})
+    if len(conversation_history) > 40:
+        conversation_history = conversation_history[-40:]
+    return llm_output
 
-def run_command(shell, cmd):
+def run_command_measured(shell, cmd, limits: Optional[dict] = None) -> dict:
+    result = {"shell": shell, "cmd": cmd, "output": "", "returncode": None, "aborted": None, "stats": None}
     try:
         sh = (shell or "cmd").lower()
         if sh in ("powershell", "pwsh"):
             pwsh_exec = shutil.which("pwsh") or shutil.which("powershell")
             if not pwsh_exec:
-                return "PowerShell executable not found"
+                result["output"] = "PowerShell executable not found"
+                return result
             args = [pwsh_exec, "-NoProfile", "-NonInteractive", "-Command", cmd]
-            completed = subprocess.run(args, capture_output=True, text=True)
+            completed = run_measured(args, limits=limits)
         elif sh == "cmd":
             args = ["cmd", "/c", cmd]
-            completed = subprocess.run(args, capture_output=True, text=True)
+            completed = run_measured(args, limits=limits)
         else:
-            completed = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        return completed.stdout if completed.returncode == 0 else completed.stderr
+            completed = run_measured(cmd, shell=True, limits=limits)
+        output = completed["stdout"] if completed["returncode"] == 0 else completed["stderr"]
+        if completed["aborted"]: output += f"\n[aborted: {completed['aborted']} exceeded]"
+        result.update(output=output, returncode=completed["returncode"],
+                      aborted=completed["aborted"], stats=completed["stats"])
     except Exception as e:
-        return str(e)
+        result["output"] = str(e)
+    return result
+
+def run_command(shell, cmd):
+    return run_command_measured(shell, cmd)["output"]
 
 def extract_json(text) -> Optional[dict]:
     def _candidates_from_fences(t: str) -> List[str]:
@@ -4,6 +4,7 @@ from tkinter import ttk, messagebox
 import platform
 import queue
 import time
+from process_stats import export_result, format_stats
 
 try: import agent
 except Exception: agent = None
@@ -83,9 +84,12 @@ class AgentUI(tk.Tk):
         style = ttk.Style(); style.configure("Treeview", font=("Consolas",11), foreground=self.fg_color,
                         background="#2c2c2c", fieldbackground="#2c2c2c")
         style.map("Treeview", background=[("selected","#444")])
-        self.cmd_tree = ttk.Treeview(right, columns=("shell","cmd"), show="headings", height=20)
+        self.cmd_tree = ttk.Treeview(right, columns=("shell","cmd","usage"), show="headings", height=20)
         self.cmd_tree.heading("shell", text="Shell"); self.cmd_tree.heading("cmd", text="Command")
-        self.cmd_tree.column("shell", width=80, anchor='center'); self.cmd_tree.column("cmd", width=380, anchor='w')
+        self.cmd_tree.heading("usage", text="Resources")
+        self.cmd_tree.column("shell", width=70, anchor='center'); self.cmd_tree.column("cmd", width=230, anchor='w')
+        self.cmd_tree.column("usage", width=180, anchor='w')
+        self.cmd_tree.tag_configure("fix", foreground=self.highlight)
         self.cmd_tree.pack(fill='both', expand=True)
         out_frame = tk.LabelFrame(right, text="Command Outputs", bg=self.bg_color, fg=self.fg_color); out_frame.pack(fill='both', expand=True, pady=(8,0))
         self.output_txt = tk.Text(out_frame, wrap='word', bg="#2c2c2c", fg="#f0f0f0",
@@ -159,8 +163,12 @@ Request: {req}
             for i, c in enumerate((self.current_parsed or {}).get("commands", []), start=1):
                 shell = c.get("shell", "cmd")
                 cmd = c.get("cmd", "")
-                out = agent.run_command(shell, cmd) if agent else "agent module not available"
-                outputs.append((i, cmd, out))
+                if agent:
+                    res = agent.run_command_measured(shell, cmd)
+                    export_result(res)
+                else:
+                    res = {"output": "agent module not available", "stats": None}
+                outputs.append((i, shell, cmd, res["output"], res["stats"]))
             self._q.put(("run_done", outputs))
         except Exception as e:
             self._q.put(("error", str(e)))
@@ -180,8 +188,12 @@ Request: {req}
             for i, c in enumerate(self.corrected_commands or [], start=1):
                 shell = c.get("shell", "cmd")
                 cmd = c.get("cmd", "")
-                out = agent.run_command(shell, cmd) if agent else "agent module not available"
-                outputs.append((i, cmd, out))
+                if agent:
+                    res = agent.run_command_measured(shell, cmd)
+                    export_result(res)
+                else:
+                    res = {"output": "agent module not available", "stats": None}
+                outputs.append((i, shell, cmd, res["output"], res["stats"]))
             self._q.put(("corrected_done", outputs))
         except Exception as e:
             self._q.put(("error", str(e)))
@@ -201,7 +213,7 @@ Request: {req}
                         self.cmd_tree.delete(i)
                     if parsed:
                         for idx, cmd in enumerate(parsed.get("commands", []), start=1):
-                            self.cmd_tree.insert("", "end", values=(cmd.get("shell"), cmd.get("cmd")))
+                            self.cmd_tree.insert("", "end", values=(cmd.get("shell"), cmd.get("cmd"), ""))
                         self.run_cmds_btn.config(state='normal')
                     else:
                         self.run_cmds_btn.config(state='disabled')
@@ -210,8 +222,12 @@ Request: {req}
                 elif tag == "run_done":
                     self.output_txt.delete("1.0", "end")
                     all_output = ""
-                    for i, cmd, out in data:
+                    # Stats map by position onto the parsed rows, not corrected ones
+                    rows = [r for r in self.cmd_tree.get_children() if "fix" not in self.cmd_tree.item(r, "tags")]
+                    for i, shell, cmd, out, stats in data:
                         all_output += f"--- Command {i} ({cmd}) Output ---\n{out}\n\n"
+                        if i <= len(rows):
+                            self.cmd_tree.set(rows[i - 1], "usage", format_stats(stats, compact=True))
                     self.output_txt.insert("1.0", all_output)
                     # Show loader
                     self.feedback_txt.delete("1.0", "end")
@@ -237,8 +253,10 @@ Request: {req}
                 elif tag == "corrected_done":
                     self.output_txt.delete("1.0", "end")
                     all_output = ""
-                    for i, cmd, out in data:
+                    for i, shell, cmd, out, stats in data:
                         all_output += f"--- Corrected Command {i} ({cmd}) Output ---\n{out}\n\n"
+                        usage = format_stats(stats, compact=True)
+                        self.cmd_tree.insert("", "end", values=(shell, f"{cmd}  (fix)", usage), tags=("fix",))
                     self.output_txt.insert("1.0", all_output)
                     self._set_status("Corrected commands run")
 
@@ -0,0 +1,287 @@
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+POSIX = os.name == "posix" and hasattr(os, "wait4")
+
+
+def limits_from_env() -> Dict[str, float]:
+    """Optional limits for generated commands.
+
+    CMD_TIMEOUT (wall seconds), CMD_CPU_LIMIT (CPU seconds) and
+    CMD_MEMORY_LIMIT_MB (address space, i.e. virtual memory, per process;
+    not RSS). Unset means unlimited. Read on every call so values loaded
+    from .env after import still apply.
+    """
+    limits: Dict[str, float] = {}
+    for key, env in (("timeout", "CMD_TIMEOUT"), ("cpu_seconds", "CMD_CPU_LIMIT"),
+                     ("memory_mb", "CMD_MEMORY_LIMIT_MB")):
+        value = os.getenv(env)
+        if value:
+            limits[key] = float(value)
+    return limits
+
+
+# Shell messages for a child killed by RLIMIT_CPU (SIGXCPU, then SIGKILL)
+_CPU_KILL_PATTERN = re.compile(r"CPU time limit|Killed")
+
+# Messages commonly printed when an allocation fails under RLIMIT_AS
+_OOM_PATTERN = re.compile(r"MemoryError|Cannot allocate memory|out of memory|bad_alloc|"
+                          r"memory exhausted|failed to allocate", re.IGNORECASE)
+
+
+def _with_rlimits(args, shell: bool, limits: Dict[str, float]):
+    """Wrap a command so /bin/sh applies CPU/memory rlimits before running it.
+
+    Setting the limits inside the child avoids preexec_fn, which is unsafe
+    when other threads (e.g. the GUI workers) are running, and the race of
+    prlimit() from the parent, where the command may fork before the limits
+    land. Children inherit the limits.
+    """
+    ulimits = []
+    if "cpu_seconds" in limits:
+        ulimits.append(f"ulimit -t {max(1, int(limits['cpu_seconds']))}")
+    if "memory_mb" in limits:
+        ulimits.append(f"ulimit -v {int(limits['memory_mb'] * 1024)}")
+    if not ulimits:
+        return args, shell
+    prefix = " && ".join(ulimits)
+    if shell:
+        return ["/bin/sh", "-c", f'{prefix} && eval "$1"', "sh", args], False
+    return ["/bin/sh", "-c", f'{prefix} && exec "$@"', "sh", *args], False
+
+
+def _kill_tree(pid: int, group: bool) -> None:
+    try:
+        if group:
+            os.killpg(pid, signal.SIGKILL)
+        elif POSIX:
+            os.kill(pid, signal.SIGKILL)
+        else:
+            os.kill(pid, signal.SIGTERM)
+    except (ProcessLookupError, PermissionError, OSError):
+        pass
+
+
+class _PeakRSSSampler(threading.Thread):
+    """Track the largest VmHWM of any process in a command's tree via /proc (Linux only).
+
+    ru_maxrss from wait4() is unusable here: on exec Linux carries the memory
+    high-water mark of the replaced address space (our own process) into the
+    child, so every command would report at least the parent's RSS. Sampling
+    starts after Popen returns, i.e. after the child has exec'd. Processes
+    that exit between samples are missed, so very short commands may report
+    no figure at all (peak is None).
+
+    The tree is walked from the root through /proc/<pid>/task/<tid>/children,
+    so the cost follows the command's process count rather than the host's.
+    Descendants already seen stay tracked after being reparented. The
+    interval doubles up to `max_interval` while the command keeps running.
+    """
+
+    def __init__(self, root: int, interval: float = 0.02, max_interval: float = 0.5):
+        super().__init__(daemon=True)
+        self.root = root
+        self.interval = interval
+        self.max_interval = max_interval
+        self.peak: Optional[int] = None
+        self._tree = {root}
+        self._done = threading.Event()
+
+    @staticmethod
+    def _children(pid: int):
+        found = []
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                found.extend(int(c) for c in f.read().split())
+        return found
+
+    def _sample(self) -> None:
+        pending, visited = list(self._tree), set()
+        while pending:
+            pid = pending.pop()
+            if pid in visited:
+                continue
+            visited.add(pid)
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    for line in f:
+                        if line.startswith("VmHWM:"):
+                            hwm = int(line.split()[1]) * 1024
+                            self.peak = hwm if self.peak is None else max(self.peak, hwm)
+                            break
+                pending.extend(self._children(pid))
+            except (OSError, ValueError, IndexError):
+                continue
+        # Forget processes that have exited; keep everything still alive
+        self._tree = {pid for pid in visited if os.path.exists(f"/proc/{pid}")} or {self.root}
+
+    def run(self) -> None:
+        interval = self.interval
+        while not self._done.is_set():
+            self._sample()
+            self._done.wait(interval)
+            interval = min(self.max_interval, interval * 2)
+
+    def stop(self) -> Optional[int]:
+        self._done.set()
+        self.join()
+        return self.peak
+
+
+def run_measured(args, shell: bool = False, limits: Optional[Dict[str, float]] = None) -> dict:
+    """Run a command and account for the resources its process tree used.
+
+    Returns a dict with stdout, stderr, returncode, aborted (None or the limit
+    that stopped the command) and stats: wall_time, user_time, system_time
+    (seconds), max_rss_bytes, read_bytes and write_bytes. On POSIX, CPU and
+    I/O come from wait4() and cover every descendant the command waited for;
+    peak RSS is sampled from /proc on Linux and is None elsewhere or when the
+    command finished too quickly to be sampled. On other platforms only
+    wall_time is measured.
+
+    The command stays in the caller's process group (so it can still prompt
+    on the terminal and receives Ctrl-C) unless a timeout is set, in which
+    case it gets its own group so the whole tree can be killed.
+    """
+    limits = limits_from_env() if limits is None else limits
+    timeout = limits.get("timeout")
+    stats = {"wall_time": None, "user_time": None, "system_time": None,
+             "max_rss_bytes": None, "read_bytes": None, "write_bytes": None}
+    start = time.monotonic()
+
+    if not POSIX:
+        try:
+            completed = subprocess.run(args, shell=shell, capture_output=True, text=True, timeout=timeout)
+            stdout, stderr, returncode, aborted = completed.stdout, completed.stderr, completed.returncode, None
+        except subprocess.TimeoutExpired as e:
+            stdout, stderr, returncode, aborted = e.stdout or "", e.stderr or "", -1, "timeout"
+        stats["wall_time"] = time.monotonic() - start
+        return {"stdout": stdout, "stderr": stderr, "returncode": returncode,
+                "aborted": aborted, "stats": stats}
+
+    group = bool(timeout)
+    popen_kwargs = {}
+    if group:
+        if sys.version_info >= (3, 11):
+            popen_kwargs["process_group"] = 0
+        else:
+            popen_kwargs["start_new_session"] = True
+    args, shell = _with_rlimits(args, shell, limits)
+    proc = subprocess.Popen(args, shell=shell, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            text=True, **popen_kwargs)
+
+    sampler = _PeakRSSSampler(proc.pid) if os.path.isdir("/proc") else None
+    if sampler:
+        sampler.start()
+
+    # Drain pipes on threads so we can reap the child ourselves with wait4()
+    captured = {}
+    readers = [threading.Thread(target=lambda name, f: captured.__setitem__(name, f.read()),
+                                args=(name, f), daemon=True)
+               for name, f in (("stdout", proc.stdout), ("stderr", proc.stderr))]
+    for t in readers:
+        t.start()
+
+    timed_out = threading.Event()
+    timer = None
+    if timeout:
+        def _on_timeout():
+            timed_out.set()
+            _kill_tree(proc.pid, group)
+        timer = threading.Timer(timeout, _on_timeout)
+        timer.daemon = True
+        timer.start()
+
+    try:
+        _, status, usage = os.wait4(proc.pid, 0)
+    except KeyboardInterrupt:
+        if timer:
+            timer.cancel()
+        _kill_tree(proc.pid, group)
+        os.waitpid(proc.pid, 0)
+        proc.returncode = -signal.SIGKILL
+        if sampler:
+            sampler.stop()
+        raise
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    # Background children may still hold the pipes open after the command
+    # itself exits; the timer stays armed until they close, so the deadline
+    # still applies and kills the rest of the group.
+    for t in readers:
+        t.join()
+    stats["wall_time"] = time.monotonic() - start
+    if timer:
+        timer.cancel()
+    proc.stdout.close()
+    proc.stderr.close()
+
+    # Block counts are 512-byte units
+    stats.update(user_time=usage.ru_utime, system_time=usage.ru_stime,
+                 max_rss_bytes=sampler.stop() if sampler else None,
+                 read_bytes=usage.ru_inblock * 512, write_bytes=usage.ru_oublock * 512)
+
+    stderr = captured.get("stderr", "")
+    aborted = None
+    if timed_out.is_set():
+        aborted = "timeout"
+    elif "cpu_seconds" in limits and usage.ru_utime + usage.ru_stime >= 0.9 * limits["cpu_seconds"] \
+            and (proc.returncode != 0 or _CPU_KILL_PATTERN.search(stderr)):
+        # Killed by SIGXCPU/SIGKILL directly, a shell reporting 128+signal, or
+        # a shell that reported the killed child and carried on. rusage can
+        # undercount slightly against the rlimit, hence the tolerance.
+        aborted = "cpu limit"
+    elif "memory_mb" in limits and proc.returncode != 0 and _OOM_PATTERN.search(stderr):
+        # RLIMIT_AS makes allocations fail rather than killing the process,
+        # so this is a best-effort match on the usual error messages
+        aborted = "memory limit"
+
+    return {"stdout": captured.get("stdout", ""), "stderr": stderr,
+            "returncode": proc.returncode, "aborted": aborted, "stats": stats}
+
+
+_export_lock = threading.Lock()
+
+
+def export_result(result: dict) -> None:
+    """Append a structured command result as a JSON line to CMD_RESULTS_FILE, if set.
+
+    Safe to call from several threads (the GUI runs commands on workers).
+    """
+    path = os.getenv("CMD_RESULTS_FILE")
+    if not path:
+        return
+    record = dict(result, timestamp=time.time())
+    with _export_lock, open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def _human_bytes(n: Optional[float]) -> str:
+    if n is None:
+        return "n/a"
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GB"
+
+
+def format_stats(stats: Optional[dict], compact: bool = False) -> str:
+    """Human-readable one-line resource summary (compact form for table cells)."""
+    if not stats or stats.get("wall_time") is None:
+        return "—" if compact else "no resource data"
+    wall = f"{stats['wall_time']:.2f}s"
+    if stats.get("user_time") is None:
+        return wall if compact else f"wall {wall}"
+    cpu = stats["user_time"] + stats["system_time"]
+    if compact:
+        return f"{wall} cpu {cpu:.2f}s {_human_bytes(stats['max_rss_bytes'])}"
+    return (f"wall {wall} | cpu {stats['user_time']:.2f}s user / {stats['system_time']:.2f}s sys"
+            f" | peak RSS {_human_bytes(stats['max_rss_bytes'])}"
+            f" | read {_human_bytes(stats['read_bytes'])} / write {_human_bytes(stats['write_bytes'])}")
@@ -0,0 +1,205 @@
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional, TypeVar
+
+from groq import APIConnectionError, APIStatusError
+
+T = TypeVar("T")
+
+# Status codes worth retrying: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUS = {408, 409, 429}
+
+
+class LLMError(Exception):
+    """Base class for LLM request failures."""
+
+
+class LLMRateLimitError(LLMError):
+    """The provider kept returning 429 after all retries."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMUnavailableError(LLMError):
+    """Transient failures (connection, timeout, 5xx) persisted after all retries."""
+
+
+class LLMRequestError(LLMError):
+    """The request was rejected and retrying will not help (e.g. 400, 401)."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `rate` units per second.
+
+    Reservations may drive the balance negative; the caller is then told how
+    long to wait, so concurrent callers are paced in arrival order.
+    """
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = float(capacity)
+        self.rate = float(rate)
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def reserve(self, amount: float) -> float:
+        """Take `amount` units and return the seconds to wait before using them."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= amount
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def adjust(self, delta: float) -> None:
+        """Return (positive) or charge (negative) units after the fact."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens + delta)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limiter shared across threads."""
+
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = TokenBucket(rpm, rpm / 60.0)
+        self.tokens = TokenBucket(tpm, tpm / 60.0)
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self._metrics = {
+            "requests": 0,
+            "throttled_requests": 0,
+            "throttle_delay_total": 0.0,
+            "throttle_delay_max": 0.0,
+            "rate_limit_hits": 0,
+            "retries": 0,
+        }
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        """Build a limiter from GROQ_RPM / GROQ_TPM (defaults match the free tier)."""
+        return cls(int(os.getenv("GROQ_RPM", "30")), int(os.getenv("GROQ_TPM", "6000")))
+
+    def acquire(self, estimated_tokens: int) -> float:
+        """Block until a request of `estimated_tokens` may be sent; return the delay."""
+        wait = max(self.requests.reserve(1), self.tokens.reserve(estimated_tokens))
+        with self._lock:
+            wait = max(wait, self._paused_until - time.monotonic())
+            self._metrics["requests"] += 1
+            if wait > 0:
+                self._metrics["throttled_requests"] += 1
+                self._metrics["throttle_delay_total"] += wait
+                self._metrics["throttle_delay_max"] = max(self._metrics["throttle_delay_max"], wait)
+        if wait > 0:
+            time.sleep(wait)
+        return max(wait, 0.0)
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every thread for `seconds` (used when the provider says retry-after)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._metrics["rate_limit_hits"] += 1
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: Optional[int]) -> None:
+        """Reconcile the token bucket with the usage reported by the provider."""
+        if actual_tokens is not None:
+            self.tokens.adjust(estimated_tokens - actual_tokens)
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self._metrics["retries"] += 1
+
+    def metrics(self) -> Dict[str, float]:
+        """Snapshot of request counts and throttling delay (seconds)."""
+        with self._lock:
+            return dict(self._metrics)
+
+
+def estimate_tokens(messages, max_completion_tokens: int) -> int:
+    """Rough token count for a chat request (~4 characters per token)."""
+    chars = sum(len(str(m.get("content", ""))) for m in messages)
+    return chars // 4 + max_completion_tokens
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    """Read retry-after-ms / retry-after (seconds or HTTP date) from an API error."""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def call_with_retry(fn: Callable[[], T], limiter: RateLimiter, estimated_tokens: int,
+                    max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0) -> T:
+    """Call `fn` through `limiter`, retrying transient failures.
+
+    Uses exponential backoff with full jitter, honours retry-after headers on
+    429s (pausing all threads sharing the limiter) and raises a typed
+    LLMError once retries are exhausted or the error is not retryable.
+    """
+    attempt = 0
+    while True:
+        limiter.acquire(estimated_tokens)
+        try:
+            return fn()
+        except APIConnectionError as e:
+            error: Exception = e
+            status = None
+        except APIStatusError as e:
+            error = e
+            status = e.status_code
+            if not (status in RETRYABLE_STATUS or status >= 500):
+                raise LLMRequestError(f"LLM request failed: {e}") from e
+
+        # The failed attempt did not consume provider tokens; give them back
+        limiter.tokens.adjust(estimated_tokens)
+        retry_after = _retry_after(error) if status == 429 else None
+        if attempt >= max_retries:
+            if status == 429:
+                raise LLMRateLimitError(f"LLM rate limit exceeded after {attempt} retries: {error}",
+                                        retry_after) from error
+            raise LLMUnavailableError(f"LLM unavailable after {attempt} retries: {error}") from error
+
+        backoff = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+        if retry_after is not None:
+            limiter.pause(retry_after + backoff * 0.1)
+        elif status == 429:
+            limiter.pause(backoff)
+        else:
+            time.sleep(backoff)
+        limiter.record_retry()
+        attempt += 1
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter() -> RateLimiter:
+    """Limiter shared by every module (and thread) that talks to Groq in this process.
+
+    Built on first use so GROQ_RPM / GROQ_TPM loaded from .env take effect.
+    """
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter.from_env()
+        return _limiter
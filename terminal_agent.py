@@ -1,4 +1,3 @@
-import subprocess
 import json
 import platform
 import uuid
@@ -6,16 +5,21 @@ import os
 import re
 import shutil
 import html
-from typing import List, Optional
+import difflib
+from typing import Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 from groq import Groq
+from process_stats import export_result, format_stats, run_measured
+from rate_limiter import LLMError, call_with_retry, estimate_tokens, get_limiter
 
 # Load environment variables
 load_dotenv()
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
 # Initialize Groq client
-client = Groq(api_key=GROQ_API_KEY)
+# Retries are handled by rate_limiter so pacing is shared across threads
+client = Groq(api_key=GROQ_API_KEY, max_retries=0)
+MAX_COMPLETION_TOKENS = 1024
 
 # Global conversation ID and history
 conversation_id = None
@@ -25,41 +29,55 @@ def query_llm(prompt: str) -> str:
     """Send a prompt to the LLM and return the assistant content.
 
     Keeps conversation history but caps it to avoid unbounded growth.
-    Returns a short error string on failure.
+    Requests are paced by the shared rate limiter and transient failures are
+    retried; raises an LLMError subclass when the request ultimately fails.
     """
     global conversation_history
-    try:
-        # Append user prompt to history
-        conversation_history.append({"role": "system","content": "You are agent who converts requests to valid shell commands based on the OS running "})
-        conversation_history.append({"role": "user", "content": prompt})
+    # Append user prompt to history
+    conversation_history.append({"role": "system","content": "You are agent who converts requests to valid shell commands based on the OS running "})
+    conversation_history.append({"role": "user", "content": prompt})
 
-        completion = client.chat.completions.create(
+    estimated = estimate_tokens(conversation_history, MAX_COMPLETION_TOKENS)
+    completion = call_with_retry(
+        lambda: client.chat.completions.create(
             model="llama-3.1-8b-instant",
             messages=conversation_history,
             temperature=1,
-            max_completion_tokens=1024,
+            max_completion_tokens=MAX_COMPLETION_TOKENS,
             top_p=1,
             stream=False,
             stop=None
-        )
+        ),
+        get_limiter(),
+        estimated,
+        max_retries=int(os.getenv("GROQ_MAX_RETRIES", "5")),
+    )
+    usage = getattr(completion, "usage", None)
+    get_limiter().record_usage(estimated, getattr(usage, "total_tokens", None))
+
+    # Extract response content (coerce None to empty string)
+    llm_output = completion.choices[0].message.content
+    if llm_output is None:
+        llm_output = ""
+    else:
+        llm_output = str(llm_output)
 
-        # Extract response content (coerce None to empty string)
-        llm_output = completion.choices[0].message.content
-        if llm_output is None:
-            llm_output = ""
-        else:
-            llm_output = str(llm_output)
+    # Update history and cap it to the last 20 messages
+    conversation_history.append({"role": "assistant", "content": llm_output})
+    if len(conversation_history) > 40:
+        conversation_history = conversation_history[-40:]
 
-        # Update history and cap it to the last 20 messages
-        conversation_history.append({"role": "assistant", "content": llm_output})
-        if len(conversation_history) > 40:
-            conversation_history = conversation_history[-40:]
+    return llm_output
 
-        return llm_output
-    except Exception as e:
-        return f"LLM error: {str(e)}"
+def run_command_measured(shell, cmd, limits: Optional[dict] = None) -> dict:
+    """Run a command and return its output together with resource usage.
 
-def run_command(shell, cmd):
+    The result dict has shell, cmd, output (stdout on success, stderr
+    otherwise), returncode, aborted (limit that stopped it, if any) and
+    stats (see process_stats.run_measured).
+    """
+    result = {"shell": shell, "cmd": cmd, "output": "", "returncode": None,
+              "aborted": None, "stats": None}
     try:
         sh = (shell or "cmd").lower()
 
@@ -67,22 +85,31 @@ def run_command(shell, cmd):
         if sh in ("powershell", "pwsh"):
             pwsh_exec = shutil.which("pwsh") or shutil.which("powershell")
             if not pwsh_exec:
-                return "PowerShell executable not found on PATH"
+                result["output"] = "PowerShell executable not found on PATH"
+                return result
             args = [pwsh_exec, "-NoProfile", "-NonInteractive", "-Command", cmd]
-            completed = subprocess.run(args, capture_output=True, text=True)
+            completed = run_measured(args, limits=limits)
 
         elif sh == "cmd":
             # Use explicit cmd /c to run the command and keep piping semantics
             args = ["cmd", "/c", cmd]
-            completed = subprocess.run(args, capture_output=True, text=True)
+            completed = run_measured(args, limits=limits)
 
         else:
             # For other shells (e.g., bash on WSL), fall back to shell=True
-            completed = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+            completed = run_measured(cmd, shell=True, limits=limits)
 
-        return completed.stdout if completed.returncode == 0 else completed.stderr
+        output = completed["stdout"] if completed["returncode"] == 0 else completed["stderr"]
+        if completed["aborted"]:
+            output += f"\n[aborted: {completed['aborted']} exceeded]"
+        result.update(output=output, returncode=completed["returncode"],
+                      aborted=completed["aborted"], stats=completed["stats"])
     except Exception as e:
-        return str(e)
+        result["output"] = str(e)
+    return result
+
+def run_command(shell, cmd):
+    return run_command_measured(shell, cmd)["output"]
 
 
 def extract_json(text) -> Optional[dict]:
@@ -209,6 +236,57 @@ def extract_summary(text: str, max_words: int = 50) -> str:
 
     return summary
 
+def build_output_delta(results: List[Tuple[str, str, Optional[int]]],
+                       previous: List[Tuple[str, str, Optional[int]]],
+                       seen_outputs: Dict[Tuple[Optional[int], str], str],
+                       round_no: int,
+                       history: List[dict]) -> str:
+    """Describe corrected command outputs relative to earlier attempts.
+
+    `results` and `previous` hold (cmd, output, returncode) tuples. Non-empty
+    outputs already reported with the same exit code are referenced by label
+    instead of being resent. When the same command text was run in the
+    previous attempt (or, failing that, another command at the same
+    position), a line-level unified diff naming that command is sent if it is
+    shorter than the full output. Everything else is sent in full.
+    `seen_outputs` maps (returncode, output) to the label it was last sent
+    in full under and is updated in place. A label is only referenced while
+    that full output is still in `history` (the capped conversation history);
+    once it has dropped out, the output is resent and re-labelled.
+    """
+    report = ""
+
+    def _in_history(label: str, rc: Optional[int]) -> bool:
+        header = f"--- {label} [exit {rc}] Output ---"
+        return header in report or any(header in str(m.get("content", "")) for m in history)
+
+    previous_by_cmd = {cmd: (out, rc) for cmd, out, rc in previous}
+    for i, (cmd, output, returncode) in enumerate(results, start=1):
+        label = f"Round {round_no} Command {i} ({cmd})"
+        key = (returncode, output)
+        if output.strip() and key in seen_outputs and _in_history(seen_outputs[key], returncode):
+            report += f"\n--- {label} [exit {returncode}] Output unchanged, same as {seen_outputs[key]} ---\n"
+            continue
+
+        if cmd in previous_by_cmd:
+            prior_cmd, (prior, prior_rc) = cmd, previous_by_cmd[cmd]
+        elif i <= len(previous):
+            prior_cmd, prior, prior_rc = previous[i - 1]
+        else:
+            prior = None
+        if prior is not None:
+            diff = "\n".join(difflib.unified_diff(
+                prior.splitlines(), output.splitlines(),
+                fromfile=f"previous ({prior_cmd}) [exit {prior_rc}]", tofile="current", lineterm=""))
+            if diff and len(diff) < len(output):
+                report += (f"\n--- {label} [exit {returncode}] Output diff vs previous output of"
+                           f" ({prior_cmd}) ---\n{diff}\n")
+                continue
+
+        report += f"\n--- {label} [exit {returncode}] Output ---\n{output}\n"
+        seen_outputs[key] = label
+    return report
+
 def main():
     os_type = platform.system()
     print(f"🤖 Detected OS: {os_type}")
@@ -217,6 +295,10 @@ def main():
     while True:
         user_input = input("📝 Enter your request (or 'exit' to quit): ")
         if user_input.lower() == "exit":
+            m = get_limiter().metrics()
+            print(f"📈 LLM requests: {m['requests']}, throttled: {m['throttled_requests']} "
+                  f"({m['throttle_delay_total']:.1f}s total, {m['throttle_delay_max']:.1f}s max), "
+                  f"rate-limit hits: {m['rate_limit_hits']}, retries: {m['retries']}")
             break
 
         system_prompt = f"""
@@ -238,15 +320,21 @@ Strictly follow this format and do not include any other text.
 User request: {user_input}
 """
 
-        llm_response = query_llm(system_prompt)
+        try:
+            llm_response = query_llm(system_prompt)
+        except LLMError as e:
+            print(f"❌ {e}")
+            continue
         print(f"\n🤖 LLM raw response:\n{llm_response}\n")
 
         parsed = extract_json(llm_response)
         if not parsed:
             print("⚠️ Attempting JSON correction...")
             retry_prompt = f"Extract ONLY the valid JSON from this response:\n{llm_response}"
-            fixed_json = query_llm(retry_prompt)
-            parsed = extract_json(fixed_json)
+            try:
+                parsed = extract_json(query_llm(retry_prompt))
+            except LLMError as e:
+                print(f"❌ {e}")
 
         if not parsed:
             print("❌ Failed to parse JSON.")
@@ -256,18 +344,32 @@ User request: {user_input}
         print(f"✅ Parsed {len(commands)} commands.")
 
         all_output = f"System: {os_type}\n"
+        # Outputs already sent to the LLM, so correction rounds only report deltas
+        previous_results: List[Tuple[str, str, Optional[int]]] = []
+        seen_outputs: Dict[Tuple[Optional[int], str], str] = {}
         for i, c in enumerate(commands, start=1):
             shell = c.get("shell", "cmd")
             cmd = c.get("cmd", "")
             print(f"▶️ Running {i}/{len(commands)} in {shell}: {cmd}")
-            output = run_command(shell, cmd)
-            all_output += f"\n--- Command {i} ({cmd}) Output ---\n{output}\n"
+            result = run_command_measured(shell, cmd)
+            output = result["output"]
+            all_output += f"\n--- Command {i} ({cmd}) [exit {result['returncode']}] Output ---\n{output}\n"
+            previous_results.append((cmd, output, result["returncode"]))
+            seen_outputs.setdefault((result["returncode"], output), f"Command {i} ({cmd})")
+            export_result(result)
             print(output)
+            print(f"⏱️ {format_stats(result['stats'])}")
 
+        correction_round = 0
         while True:
             print("🔄 Sending outputs back for feedback...")
+            if correction_round == 0:
+                intro = f"The following commands were executed for the user's request: {user_input}"
+            else:
+                intro = (f"Corrected commands (round {correction_round}) were executed for the user's request: {user_input}\n"
+                         "Only new or changed outputs are shown; unchanged outputs refer to earlier results.")
             feedback_prompt = f"""
-The following commands were executed for the user's request: {user_input}
+{intro}
 
 Outputs:
 {all_output}
@@ -281,7 +383,11 @@ Please provide:
   ]
 }}
 """
-            feedback = query_llm(feedback_prompt)
+            try:
+                feedback = query_llm(feedback_prompt)
+            except LLMError as e:
+                print(f"❌ {e}")
+                break
             print(f"\n📊 LLM Feedback:\n{feedback}\n")
 
             # Try parsing the JSON summary from feedback
@@ -314,15 +420,22 @@ Please provide:
                 break
 
             commands = corrected_commands
+            correction_round += 1
             print(f"▶️ Running {len(commands)} corrected commands...\n")
-            all_output = ""
+            results: List[Tuple[str, str, Optional[int]]] = []
             for i, c in enumerate(commands, start=1):
                 shell = c.get("shell", "cmd")
                 cmd = c.get("cmd", "")
                 print(f"▶️ Running corrected {i}/{len(commands)} in {shell}: {cmd}")
-                output = run_command(shell, cmd)
-                all_output += f"\n--- Corrected Command {i} ({cmd}) Output ---\n{output}\n"
+                result = run_command_measured(shell, cmd)
+                output = result["output"]
+                results.append((cmd, output, result["returncode"]))
+                export_result(result)
                 print(output)
+                print(f"⏱️ {format_stats(result['stats'])}")
+            all_output = build_output_delta(results, previous_results, seen_outputs,
+                                            correction_round, conversation_history)
+            previous_results = results
 
 if __name__ == "__main__":
     main()